@@ -32,66 +32,118 @@ __author__   = 'Austin Bowen <arbowen@g.clemson.edu>'
 __date__     = '2016-12-02 Fr'
 __all__      = ['id3', 'ID3DecisionTree', 'ID3DecisionTreeNode']
 
+from array import array
+from collections import Counter
 from math import log2
+from typing import (
+    Any, Dict, Hashable, Iterable, Iterator, List, Mapping, NamedTuple,
+    Optional, Sequence, Tuple
+)
+
+# A path through the tree, as a tuple of (attribute name, value) pairs
+_Path = Tuple[Tuple[Hashable, Any], ...]
 
 class ID3DecisionTree:
     '''An ID3 decision tree.'''
     
-    __slots__ = {'root_node': None}
+    __slots__ = ('root_node',)
+    
+    root_node: Any
     
-    def __init__(self, root_node):
+    def __init__(self, root_node: Any) -> None:
         self.root_node = root_node
     
-    def __call__(self, inputs):
+    def __call__(self, inputs: Mapping[Hashable, Any]) -> Any:
         '''The tree may be called like a function, returning the tree's output
         given a dict of inputs.
         '''
-        node = self.root_node
-        # Traverse the nodes until a leaf is reached
-        while isinstance(node, ID3DecisionTreeNode):
+        node_type = ID3DecisionTreeNode
+        node      = self.root_node
+        # Traverse the nodes until a leaf is reached.  This is the innermost
+        # loop of evaluation, so the node type is compared exactly rather than
+        # with isinstance(), and the value map is used directly.
+        while (type(node) is node_type):
             # Get the next node
-            node = node.get_subnode_for_input(inputs[node.name])
+            node = node._value_map.get(inputs[node.name])
         return node
     
-    def __str__(self):
+    def __str__(self) -> str:
         '''Returns a "pretty" string showing the entire decision tree.
-        Note:  If the recursion limit is hit, then there is probably a loop
-        in the tree for some reason.
+        Note:  The tree is walked without recursion, so a loop in the tree
+        will not raise a RecursionError; the string will just never end.
         '''
-        
-        def tree_str(node, prefix=''):
+        # Walk the tree depth-first using an explicit stack.  Each stack item
+        # is either a string fragment ready to be output, or a (node, prefix)
+        # pair still to be expanded.  The fragments are joined once at the end.
+        parts: List[str] = []
+        stack: List[Any] = [(self.root_node, '')]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                parts.append(item)
+                continue
+            
+            node, prefix = item
             if isinstance(node, ID3DecisionTreeNode):
-                s = '{}{}:\n'.format(prefix, node.name)
-                for value, subnode in node.value_subnode_pairs:
-                    s += '{}{}'.format(prefix, value)
-                    if isinstance(subnode, ID3DecisionTreeNode): s += '\n'
-                    else: s += ' '
-                    s += tree_str(subnode, prefix+'  ')
-                return s
+                parts.append('{}{}:\n'.format(prefix, node.name))
+                # Push in reverse so that the pairs are output in order
+                for value, subnode in reversed(node.value_subnode_pairs):
+                    stack.append((subnode, prefix+'  '))
+                    if isinstance(subnode, ID3DecisionTreeNode): end = '\n'
+                    else: end = ' '
+                    stack.append('{}{}{}'.format(prefix, value, end))
             else:
-                return '-> {}\n'.format(node)
+                parts.append('-> {}\n'.format(node))
         
         return '{}:\n{}'.format(
             object.__str__(self),
-            tree_str(self.root_node)[:-1]
+            ''.join(parts)[:-1]
         )
     
-    def get_inputs_for_output(self, output):
+    def get_inputs_for_output(self, output: Any) -> List[Dict[Hashable, Any]]:
         '''Returns a list of inputs that will give the specified output.'''
         if not isinstance(self.root_node, ID3DecisionTreeNode): return []
         
-        def get_inputs(node, output, input={}, inputs=[]):
+        def walk(
+            node: 'ID3DecisionTreeNode',
+            path: _Path
+        ) -> Iterator[Tuple[Any, _Path]]:
+            # Yields a (leaf, path) pair for every leaf under the node, where
+            # path is a tuple of the (name, value) pairs leading to the leaf
             for value, subnode in node.value_subnode_pairs:
-                input[node.name] = value
+                subpath = path + ((node.name, value),)
                 if isinstance(subnode, ID3DecisionTreeNode):
-                    get_inputs(subnode, output, dict(input), inputs)
-                elif (subnode == output):
-                    inputs.append(dict(input))
-            return inputs
+                    yield from walk(subnode, subpath)
+                else:
+                    yield subnode, subpath
         
-        return get_inputs(self.root_node, output)
+        return [
+            dict(path) for leaf, path in walk(self.root_node, ())
+            if (leaf == output)
+        ]
     
-    def validate(self, exemplars):
+    def predict_batch(
+        self,
+        inputs_list: Iterable[Mapping[Hashable, Any]]
+    ) -> List[Any]:
+        '''Returns a list of the tree's outputs for each dict of inputs in the
+        given iterable.  This is equivalent to calling the tree on each dict
+        of inputs, but avoids the per-call overhead.
+        '''
+        node_type    = ID3DecisionTreeNode
+        root_node    = self.root_node
+        tree_outputs: List[Any] = []
+        for inputs in inputs_list:
+            node = root_node
+            while (type(node) is node_type):
+                node = node._value_map.get(inputs[node.name])
+            tree_outputs.append(node)
+        return tree_outputs
+    
+    def validate(
+        self,
+        exemplars: Iterable[Tuple[Mapping[Hashable, Any], Any]]
+    ) -> bool:
         '''Returns True if the decision tree is valid in comparison to the given
         exemplars; that is, the tree is valid if its output matches the output
         for all (inputs, output) exemplar pairs.
@@ -100,33 +152,130 @@ class ID3DecisionTree:
         exemplars (at least 2 exemplars with the same inputs but differing
         outputs) during training.
         '''
-        for inputs, output in exemplars:
-            if (self(inputs) != output): return False
+        exemplar_list = list(exemplars)
+        tree_outputs  = self.predict_batch(inputs for inputs, _ in exemplar_list)
+        for tree_output, (_, output) in zip(tree_outputs, exemplar_list):
+            if (tree_output != output): return False
         return True
 
 class ID3DecisionTreeNode:
-    __slots__ = {
-        'name'               : None,
-        'value_subnode_pairs': None,
-    }
+    __slots__ = ('name', 'value_subnode_pairs', '_value_map', '_hash')
     
-    def __init__(self, name, value_subnode_pairs):
+    name:                Hashable
+    value_subnode_pairs: Sequence[Tuple[Any, Any]]
+    _value_map:          Dict[Any, Any]
+    _hash:               Optional[int]
+    
+    def __init__(
+        self,
+        name: Hashable,
+        value_subnode_pairs: Sequence[Tuple[Any, Any]]
+    ) -> None:
         self.name = name
         self.value_subnode_pairs = value_subnode_pairs
+        # Maps each value to its subnode for constant-time lookups
+        self._value_map = dict(value_subnode_pairs)
+        # Structural hash of the subtree, computed on first use
+        self._hash = None
+    
+    def __eq__(self, other: object) -> bool:
+        '''Nodes are equal if their subtrees are structurally equal.'''
+        if (self is other): return True
+        if (type(other) is not ID3DecisionTreeNode): return NotImplemented
+        return (
+            (self.name == other.name)
+            and (hash(self) == hash(other))
+            and (
+                tuple(self.value_subnode_pairs)
+                == tuple(other.value_subnode_pairs)
+            )
+        )
+    
+    def __hash__(self) -> int:
+        # The hash combines the name with the hashes of the values and
+        # subnodes.  Subnode hashes are cached, so each node is hashed once.
+        if (self._hash is None):
+            self._hash = hash((self.name, tuple(self.value_subnode_pairs)))
+        return self._hash
     
-    def __str__(self):
+    def __str__(self) -> str:
         return '{}:{{ name=\'{}\' }}'.format(object.__str__(self), self.name)
     
-    def get_subnode_for_input(self, input):
-        for value, subnode in self.value_subnode_pairs:
-            if (input == value): return subnode
-        return None
+    def get_subnode_for_input(self, input: Any) -> Any:
+        return self._value_map.get(input)
+
+class _Split(NamedTuple):
+    '''Marks that the subtrees for each of the (encoded) attribute values of
+    attr have been built, while building a tree in id3().
+    '''
+    attr:        int
+    attr_values: List[int]
+
+def _count_outputs(
+    outputs: List[int],
+    weights: List[int],
+    idx: List[int]
+) -> 'Counter[int]':
+    '''Returns a Counter of the (weighted) outputs of the rows in idx.'''
+    output_counts: 'Counter[int]' = Counter()
+    for i in idx: output_counts[outputs[i]] += weights[i]
+    return output_counts
+
+def _best_attr(
+    columns: List[List[int]],
+    outputs: List[int],
+    weights: List[int],
+    log2_table: 'array[float]',
+    idx: List[int],
+    attrs: Tuple[int, ...]
+) -> Tuple[int, Dict[int, List[int]]]:
+    '''Returns a 2-tuple (attr, partitions) for the attribute in attrs with
+    the lowest entropy over the rows in idx.  The keys in the partitions dict
+    are the encoded values of that attribute, and the value associated with
+    each key is a list of the rows in idx having that attribute value.
+    '''
+    # Calculate the entropy of each attribute.  Only the (weighted) output
+    # counts for each attribute value are needed for this, so no partitions
+    # are built for the attributes that are not chosen.
+    entropies: List[float] = []
+    for attr in attrs:
+        column = columns[attr]
+        counts: Dict[int, Dict[int, int]] = {}
+        for i in idx:
+            value        = column[i]
+            value_counts = counts.get(value)
+            if value_counts is None: value_counts = counts[value] = {}
+            output = outputs[i]
+            value_counts[output] = value_counts.get(output, 0) + weights[i]
+        
+        # Sum the entropy using the identity
+        # -c*log2(c/n) = c*log2(n) - c*log2(c) summed over the counts
+        attr_entropy = 0.0
+        for value_counts in counts.values():
+            value_count   = sum(value_counts.values())
+            attr_entropy += value_count*log2_table[value_count]
+            for output_count in value_counts.values():
+                attr_entropy -= output_count*log2_table[output_count]
+        entropies.append(attr_entropy)
+    
+    # Choose the first attribute with the lowest entropy, and partition the
+    # rows based on their value for that attribute only
+    best_attr  = attrs[min(range(len(attrs)), key=entropies.__getitem__)]
+    column     = columns[best_attr]
+    partitions: Dict[int, List[int]] = {}
+    for i in idx:
+        partitions.setdefault(column[i], []).append(i)
+    
+    return best_attr, partitions
 
-def id3(exemplars):
+def id3(
+    exemplars: Sequence[Tuple[Mapping[Hashable, Any], Any]]
+) -> ID3DecisionTree:
     '''Creates a decision tree from the exemplars using the ID3 algorithm.
     Each exemplar should be a 2-tuple of the format (inputs, output).
     The inputs of each exemplar should be a dict where each key is an
     attribute name and each key's value is the attribute value.
+    Identical subtrees are shared between the branches of the returned tree.
     
     Example usage:
     >>> from id3 import id3
@@ -149,75 +298,110 @@ def id3(exemplars):
     >>> 
     '''
     
-    def id3_helper(exemplars):
-        # Get the set of possible output values
-        output_set = {output for _, output in exemplars}
-        # Return None if there are no exemplars
-        if   (len(output_set) == 0): return None
-        # Return the output value if there is only one output value
-        elif (len(output_set) == 1): return exemplars[0][1]
+    # Integer-encode the attribute values and outputs once up front.  Each
+    # exemplar's inputs become a row (tuple) of ints, one column per attribute,
+    # so that the exemplars can be partitioned by row index instead of copying
+    # dicts, and all comparisons and counting during the build are on ints.
+    attr_names = list(exemplars[0][0].keys()) if exemplars else []
+    encoders: List[Dict[Any, int]] = [{} for _ in attr_names]
+    rows = [
+        tuple(
+            encoder.setdefault(inputs[name], len(encoder))
+            for name, encoder in zip(attr_names, encoders)
+        )
+        for inputs, _ in exemplars
+    ]
+    decoders = [list(encoder) for encoder in encoders]
+    output_encoder: Dict[Any, int] = {}
+    outputs = [
+        output_encoder.setdefault(output, len(output_encoder))
+        for _, output in exemplars
+    ]
+    output_decoder = list(output_encoder)
+    
+    # Duplicate exemplars always fall into the same partitions and contribute
+    # identically to every entropy, so collapse them into a single row with a
+    # weight instead of carrying each copy through the entire build.
+    exemplar_counts = Counter(zip(rows, outputs))
+    rows    = [row    for row, _    in exemplar_counts]
+    outputs = [output for _, output in exemplar_counts]
+    weights = list(exemplar_counts.values())
+    
+    # Store the encoded inputs column-major (one list per attribute) so that
+    # scoring an attribute only has to walk that attribute's column
+    columns = [list(column) for column in zip(*rows)]
+    
+    # Counts never exceed the number of exemplars, so precompute log2 of every
+    # possible count; log2_table[i] is log2(i), with log2_table[0] unused.
+    # The table is stored as an array of unboxed doubles, which takes a
+    # quarter of the memory of a list of float objects.
+    log2_table = array('d', [0.0])
+    log2_table.extend(log2(i) for i in range(1, sum(weights)+1))
+    
+    # Build the tree depth-first without recursion.  Each item on the work
+    # stack is either an (idx, attrs) pair of the rows and remaining attributes
+    # to build a subtree from, or a _Split marking that the subtrees for each
+    # value of an attribute are complete and on top of the subnodes stack.
+    subnodes: List[Any] = []
+    interned: Dict[ID3DecisionTreeNode, ID3DecisionTreeNode] = {}
+    work: List[Any] = [
+        (list(range(len(outputs))), tuple(range(len(attr_names))))
+    ]
+    while work:
+        item = work.pop()
+        
+        # Create the decision tree node for a split whose subtrees are done
+        if isinstance(item, _Split):
+            first   = len(subnodes) - len(item.attr_values)
+            decoder = decoders[item.attr]
+            value_subnode_pairs = [
+                (decoder[attr_value], subnode)
+                for attr_value, subnode in zip(item.attr_values, subnodes[first:])
+            ]
+            del subnodes[first:]
+            # Share structurally identical subtrees rather than keeping copies
+            node = ID3DecisionTreeNode(attr_names[item.attr], value_subnode_pairs)
+            subnodes.append(interned.setdefault(node, node))
+            continue
         
-        # Determine if each input has only a single value across all exemplars
-        inputs_all_same = True
-        for inputs0, _ in exemplars:
-            for inputs1, _ in exemplars:
-                if (inputs0 != inputs1):
-                    inputs_all_same = False
-                    break
-            if not inputs_all_same: break
+        idx, attrs = item
+        
+        # Use None if there are no exemplars
+        if not idx:
+            subnodes.append(None)
+            continue
+        # Use the output value if there is only one output value.  This stops
+        # at the first differing output rather than building a set of them.
+        first        = idx[0]
+        first_output = outputs[first]
+        if all((outputs[i] == first_output) for i in idx):
+            subnodes.append(output_decoder[first_output])
+            continue
+        
+        # Determine if each input has only a single value across all exemplars.
+        # Attributes already partitioned on are constant within idx, so only
+        # the remaining attributes need to be checked.
+        inputs_all_same = all(
+            all((column[i] == column[first]) for i in idx)
+            for column in (columns[attr] for attr in attrs)
+        )
         # All inputs are the same?
         if inputs_all_same:
             # Choose the most common output
-            outputs = [output for _, output in exemplars]
-            most_common       = None
-            most_common_count = 0
-            for output in set(outputs):
-                count = outputs.count(output)
-                if (count > most_common_count):
-                    most_common       = output
-                    most_common_count = count
-            return most_common
+            output_counts = _count_outputs(outputs, weights, idx)
+            subnodes.append(output_decoder[output_counts.most_common(1)[0][0]])
+            continue
         
         # Find the best attribute (lowest entropy) to partition the exemplars
-        best_attr = None
-        for attr in exemplars[0][0].keys():
-            # Get the set of possible attribute values for this attribute
-            attr_values = {inputs[attr] for inputs, _ in exemplars}
-            
-            # Partition the current attribute based on its possible values.
-            # The keys in the partitions dict represent a possible attribute
-            # value, and the value associated with each key is a list of
-            # exemplars belonging to that attribute value.
-            partitions = {}
-            for attr_value in attr_values: partitions[attr_value] = []
-            for inputs, output in exemplars:
-                inputs     = dict(inputs)
-                attr_value = inputs.pop(attr)
-                partitions[attr_value].append((inputs, output))
-            
-            # Calculate the attribute entropy
-            attr_entropy = 0
-            for attr_value in partitions:
-                outputs = [output for _, output in partitions[attr_value]]
-                for output in set(outputs):
-                    output_count  = outputs.count(output)
-                    attr_entropy -= output_count*log2(output_count/len(outputs))
-            
-            # Determine if the current attribute is better than the current best
-            if not best_attr or (attr_entropy < best_attr['entropy']):
-                best_attr = {
-                    'attr'      : attr,
-                    'entropy'   : attr_entropy,
-                    'partitions': partitions,
-                }
-        
-        # Create and return the decision tree node for the best attribute
-        value_subnode_pairs = []
-        for attr_value in best_attr['partitions']:
-            partition = best_attr['partitions'][attr_value]
-            subnode   = id3_helper(partition)
-            value_subnode_pairs.append((attr_value, subnode))
+        attr, partitions = _best_attr(
+            columns, outputs, weights, log2_table, idx, attrs
+        )
         
-        return ID3DecisionTreeNode(best_attr['attr'], value_subnode_pairs)
+        # Build a subtree for each partition, then the node for the attribute.
+        # The partitions are pushed in reverse so they are built in order.
+        sub_attrs = tuple(a for a in attrs if (a != attr))
+        work.append(_Split(attr, list(partitions)))
+        for partition in reversed(list(partitions.values())):
+            work.append((partition, sub_attrs))
     
-    return ID3DecisionTree(id3_helper(exemplars))
+    return ID3DecisionTree(subnodes[0])